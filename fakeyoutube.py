@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Local stand-in for the parts of the YouTube Data API v3 used by getvideos.py:
+channels, playlists, playlistItems, search and videos list requests.
+
+Every channel and playlist ID exists and has a deterministic list of videos, so
+any synthetic list.txt can be refreshed against it. Latency, random server errors,
+random and budget based quota errors and the page size are configurable.
+/videoplayback stands in for the short-lived googlevideo media URLs: it serves
+synthetic media with byte ranges, expires and can drop connections mid-download.
+/vi/ serves the thumbnails referenced by the list responses.
+Run it standalone and point getvideos.py at it with --api-endpoint, or use
+loadtest.py which does both.
+'''
+
+import argparse
+import hashlib
+import json
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+SERVICE_PATH = "/youtube/v3/"
+
+# quota units charged by the real API for one list request
+QUOTA_COST = {"channels": 1, "playlists": 1, "playlistItems": 1, "search": 100, "videos": 1}
+
+DEFAULT_CONFIG = {
+    "latency": 0.0,             # mean delay of every response, in seconds
+    "jitter": 0.0,              # uniformly distributed extra delay, in seconds
+    "error_rate": 0.0,          # fraction of requests answered with 500 backendError
+    "quota_error_rate": 0.0,    # fraction of requests answered with 403 quotaExceeded
+    "quota_limit": None,        # quota units per API key before every request fails with quotaExceeded
+    "page_size": 50,            # maximum number of items in one page, like the real API
+    "items": 120,               # number of videos in every channel and playlist
+    "live_rate": 0.02,          # fraction of videos that are upcoming or live
+    "seed": 0,
+    "media_size": 1 << 20,      # size of every /videoplayback media file, in bytes
+    "media_drop_after": None,   # drop every /videoplayback connection after this many body bytes
+    "thumbnail_version": 0,     # change to make every thumbnail show a different image
+    "thumbnail_error_page": False,  # answer thumbnail requests with a 200 HTML page instead of an image
+}
+
+THUMBNAIL_SIZES = {"default": (120, 90), "mqdefault": (320, 180), "hqdefault": (480, 360)}
+
+MEDIA_PERIOD = 65521  # prime, so a resume at a wrong offset never lines up with the pattern
+
+
+def _hash(*parts):
+    return hashlib.sha1("/".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def _videoId(feed_id, index):
+    return "v" + _hash(feed_id, index)[:10]
+
+
+def _mediaBlock(video_id):
+    block = b""
+    seed = _hash(video_id, "media").encode("ascii")
+    while len(block) < MEDIA_PERIOD:
+        seed = hashlib.sha1(seed).digest()
+        block += seed
+    return block[:MEDIA_PERIOD]
+
+
+def mediaBytes(video_id, start, end):
+    '''
+    Return bytes start..end (inclusive) of the synthetic media file of video_id.
+    '''
+    block = _mediaBlock(video_id)
+    offset = start % MEDIA_PERIOD
+    data = block[offset:] + block * ((end - start + 1) // MEDIA_PERIOD + 1)
+    return data[:end - start + 1]
+
+
+def thumbnailPng(image_id, name, version=0):
+    '''
+    Return a solid colour PNG standing in for a thumbnail. Only eight colours are used,
+    so many different thumbnail URLs share the same content.
+    '''
+    width, height = THUMBNAIL_SIZES.get(name, THUMBNAIL_SIZES["default"])
+    colour = int(_hash(image_id, "colour", version), 16) % 8
+    pixel = bytes([255 * (colour & 1), 255 * (colour >> 1 & 1), 255 * (colour >> 2 & 1)])
+    raw = (b"\x00" + pixel * width) * height
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+def parseRange(header, size):
+    '''
+    Parse a single "bytes=" Range header against a file of size bytes.
+    Return (start, end) inclusive, None when the header is absent or not understood
+    (the whole file is sent) and False when the range cannot be satisfied.
+    '''
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _published(feed_id, index):
+    # newest video first, roughly one video every 1-3 days
+    rnd = random.Random(_hash(feed_id, "date"))
+    start = datetime(2024, 1, 1) - timedelta(days=rnd.randint(0, 30))
+    return (start - timedelta(days=2 * index, hours=rnd.randint(0, 23))).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeYoutube(object):
+    '''
+    State shared by all request handlers: configuration, generated data and statistics.
+    '''
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_CONFIG)
+        if config is not None:
+            self.config.update(config)
+        self.random = random.Random(self.config["seed"])
+        self.lock = threading.Lock()
+        self.base_url = ""
+        self.resetStats()
+
+    def resetStats(self):
+        with self.lock:
+            self.stats = {
+                "requests": dict((name, 0) for name in QUOTA_COST),
+                "errors": 0,
+                "quota_errors": 0,
+                "quota_used": {},
+                "media_requests": 0,
+                "thumbnail_requests": 0,
+            }
+
+    def getStats(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def thumbnails(self, video_id):
+        url = "{0}/vi/{1}/".format(self.base_url, video_id)
+        return {
+            "default": {"url": url + "default.jpg", "width": 120, "height": 90},
+            "medium": {"url": url + "mqdefault.jpg", "width": 320, "height": 180},
+            "high": {"url": url + "hqdefault.jpg", "width": 480, "height": 360},
+        }
+
+    def videoSnippet(self, feed_id, index, channel_id):
+        video_id = _videoId(feed_id, index)
+        return video_id, {
+            "publishedAt": _published(feed_id, index),
+            "channelId": channel_id,
+            "title": "Video {0} of {1} & friends".format(index, feed_id),
+            "description": "Synthetic <video> {0}".format(video_id),
+            "thumbnails": self.thumbnails(video_id),
+            "channelTitle": "Channel " + channel_id,
+            "liveBroadcastContent": self.liveState(video_id),
+        }
+
+    def liveState(self, video_id):
+        rnd = random.Random(_hash(video_id, "live"))
+        if rnd.random() < self.config["live_rate"]:
+            return rnd.choice(["upcoming", "live"])
+        return "none"
+
+    def page(self, feed_id, params, build):
+        try:
+            max_results = min(int(params.get("maxResults", 5)), self.config["page_size"])
+        except ValueError:
+            max_results = 5
+        try:
+            offset = int(params.get("pageToken", "0") or "0")
+        except ValueError:
+            offset = 0
+        end = min(offset + max_results, self.config["items"])
+        response = {
+            "kind": "youtube#listResponse",
+            "pageInfo": {"totalResults": self.config["items"], "resultsPerPage": max_results},
+            "items": [build(i) for i in range(offset, end)],
+        }
+        if end < self.config["items"]:
+            response["nextPageToken"] = str(end)
+        if offset > 0:
+            response["prevPageToken"] = str(max(0, offset - max_results))
+        return response
+
+    def channels(self, params):
+        items = []
+        for channel_id in params.get("id", "").split(","):
+            if not channel_id:
+                continue
+            snippet = {
+                "title": "Channel " + channel_id,
+                "description": "Synthetic channel & <description>",
+                "thumbnails": self.thumbnails(channel_id),
+                "publishedAt": "2015-01-01T00:00:00Z",
+            }
+            items.append({"kind": "youtube#channel", "id": channel_id, "snippet": snippet})
+        return {"kind": "youtube#channelListResponse", "items": items}
+
+    def playlists(self, params):
+        items = []
+        for playlist_id in params.get("id", "").split(","):
+            if not playlist_id:
+                continue
+            snippet = {
+                "title": "Playlist " + playlist_id,
+                "description": "Synthetic playlist & <description>",
+                "channelId": "UC" + _hash(playlist_id)[:22],
+                "channelTitle": "Owner of " + playlist_id,
+                "thumbnails": self.thumbnails(playlist_id),
+                "publishedAt": "2015-01-01T00:00:00Z",
+            }
+            items.append({"kind": "youtube#playlist", "id": playlist_id, "snippet": snippet})
+        return {"kind": "youtube#playlistListResponse", "items": items}
+
+    def playlistItems(self, params):
+        playlist_id = params.get("playlistId", "")
+
+        def build(i):
+            video_id, snippet = self.videoSnippet(playlist_id, i, "UC" + _hash(playlist_id)[:22])
+            snippet["playlistId"] = playlist_id
+            snippet["position"] = i
+            snippet["resourceId"] = {"kind": "youtube#video", "videoId": video_id}
+            # playlist items do not carry the live state, getvideos.py asks videos.list for it
+            del snippet["liveBroadcastContent"]
+            return {"kind": "youtube#playlistItem", "id": _hash(playlist_id, i)[:24], "snippet": snippet}
+
+        return self.page(playlist_id, params, build)
+
+    def search(self, params):
+        channel_id = params.get("channelId", "")
+
+        def build(i):
+            video_id, snippet = self.videoSnippet(channel_id, i, channel_id)
+            return {"kind": "youtube#searchResult", "id": {"kind": "youtube#video", "videoId": video_id},
+                    "snippet": snippet}
+
+        return self.page(channel_id, params, build)
+
+    def videos(self, params):
+        items = []
+        for video_id in params.get("id", "").split(","):
+            if not video_id:
+                continue
+            snippet = {
+                "title": "Video " + video_id,
+                "description": "Synthetic <video> {0}".format(video_id),
+                "thumbnails": self.thumbnails(video_id),
+                "liveBroadcastContent": self.liveState(video_id),
+            }
+            items.append({"kind": "youtube#video", "id": video_id, "snippet": snippet})
+        return {"kind": "youtube#videoListResponse", "items": items}
+
+    def handle(self, endpoint, params):
+        '''
+        Answer one list request and return (status, body). Injected errors and quota
+        accounting happen here, the delay is applied by the request handler.
+        '''
+        key = params.get("key")
+        if not key:
+            return 403, _error(403, "forbidden", "The request is missing a valid API key.")
+
+        with self.lock:
+            self.stats["requests"][endpoint] += 1
+            roll = self.random.random()
+            used = self.stats["quota_used"].get(key, 0)
+            limit = self.config["quota_limit"]
+            if roll < self.config["quota_error_rate"] or (limit is not None and used + QUOTA_COST[endpoint] > limit):
+                self.stats["quota_errors"] += 1
+                return 403, _error(403, "quotaExceeded",
+                                   "The request cannot be completed because you have exceeded your quota.",
+                                   domain="youtube.quota")
+            if roll < self.config["quota_error_rate"] + self.config["error_rate"]:
+                self.stats["errors"] += 1
+                return 500, _error(500, "backendError", "Backend Error")
+            self.stats["quota_used"][key] = used + QUOTA_COST[endpoint]
+
+        return 200, getattr(self, endpoint)(params)
+
+    def delay(self):
+        latency = self.config["latency"]
+        if self.config["jitter"] > 0:
+            with self.lock:
+                latency += self.random.uniform(0, self.config["jitter"])
+        if latency > 0:
+            time.sleep(latency)
+
+
+def _error(code, reason, message, domain="global"):
+    return {"error": {"code": code, "message": message,
+                      "errors": [{"message": message, "domain": domain, "reason": reason}]}}
+
+
+class FakeYoutubeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = parse.urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in parse.parse_qs(url.query).items())
+
+        if url.path == "/stats":
+            return self.sendJson(200, fake.getStats())
+        if url.path == "/videoplayback":
+            fake.delay()
+            return self.sendMedia(params)
+        if url.path.startswith("/vi/"):
+            fake.delay()
+            return self.sendThumbnail(url.path)
+
+        endpoint = url.path[len(SERVICE_PATH):] if url.path.startswith(SERVICE_PATH) else None
+        if endpoint not in QUOTA_COST:
+            return self.sendJson(404, _error(404, "notFound", "Unknown endpoint {0}".format(url.path)))
+
+        fake.delay()
+        status, body = fake.handle(endpoint, params)
+        self.sendJson(status, body)
+
+    def sendMedia(self, params):
+        '''
+        Short-lived media URL stand-in: /videoplayback?id=VID&expire=UNIX_TIME answers 403
+        once expired and honours single byte ranges.
+        '''
+        fake = self.server.fake
+        expire = params.get("expire")
+        if expire is not None and float(expire) < time.time():
+            return self.sendJson(403, _error(403, "forbidden", "URL expired"))
+
+        size = fake.config["media_size"]
+        byte_range = parseRange(self.headers.get("Range"), size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{0}".format(size))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if byte_range:
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, size))
+        self.end_headers()
+        with fake.lock:
+            fake.stats["media_requests"] += 1
+
+        drop_after = fake.config["media_drop_after"]
+        if drop_after is not None and drop_after < end - start + 1:
+            end = start + drop_after - 1
+            self.close_connection = True
+        chunk = 1 << 16
+        try:
+            for offset in range(start, end + 1, chunk):
+                self.wfile.write(mediaBytes(params.get("id", ""), offset, min(offset + chunk - 1, end)))
+        except (BrokenPipeError, ConnectionResetError):
+            # clients stop reading once they have the bytes they need
+            self.close_connection = True
+
+    def sendThumbnail(self, path):
+        # /vi/<video, channel or playlist id>/<default|mqdefault|hqdefault>.jpg
+        parts = path.split("/")
+        if len(parts) != 4:
+            return self.sendJson(404, _error(404, "notFound", "Unknown thumbnail {0}".format(path)))
+        fake = self.server.fake
+        with fake.lock:
+            fake.stats["thumbnail_requests"] += 1
+        if fake.config["thumbnail_error_page"]:
+            data = b"<html><body>Something went wrong</body></html>"
+            content_type = "text/html; charset=utf-8"
+        else:
+            data = thumbnailPng(parts[2], parts[3].split(".")[0], fake.config["thumbnail_version"])
+            content_type = "image/png"
+        etag = '"{0}"'.format(hashlib.sha1(data).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.writeBody(data)
+
+    def sendJson(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.writeBody(data)
+
+    def writeBody(self, data):
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client was killed or gave up, e.g. getvideos.py stopped by loadtest.py --timeout
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeYoutubeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # getvideos.py opens one connection per feed at once, do not refuse them
+    request_queue_size = 1024
+
+    def __init__(self, address, config=None):
+        ThreadingHTTPServer.__init__(self, address, FakeYoutubeHandler)
+        self.fake = FakeYoutube(config)
+        host, port = self.server_address[:2]
+        self.fake.base_url = "http://{0}:{1}".format(host, port)
+
+    def handle_error(self, request, client_address):
+        # clients killed mid-request, e.g. by loadtest.py --timeout, are expected here
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        ThreadingHTTPServer.handle_error(self, request, client_address)
+
+    @property
+    def api_endpoint(self):
+        # the discovery document of the client already prefixes every method with youtube/v3/
+        return self.fake.base_url + "/"
+
+
+def start(host="127.0.0.1", port=0, config=None):
+    '''
+    Start a server in a background thread and return it. Port 0 picks a free port,
+    server.api_endpoint is the value for getvideos.py --api-endpoint.
+    '''
+    server = FakeYoutubeServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def addConfigArguments(parser):
+    parser.add_argument("--latency", dest="latency", type=float, default=DEFAULT_CONFIG["latency"],
+                        help="Mean response delay in seconds.\n", metavar="SEC")
+    parser.add_argument("--jitter", dest="jitter", type=float, default=DEFAULT_CONFIG["jitter"],
+                        help="Extra random delay, up to SEC seconds.\n", metavar="SEC")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=DEFAULT_CONFIG["error_rate"],
+                        help="Fraction of requests failing with 500 backendError.\n", metavar="RATE")
+    parser.add_argument("--quota-error-rate", dest="quota_error_rate", type=float,
+                        default=DEFAULT_CONFIG["quota_error_rate"],
+                        help="Fraction of requests failing with 403 quotaExceeded.\n", metavar="RATE")
+    parser.add_argument("--quota-limit", dest="quota_limit", type=int, default=DEFAULT_CONFIG["quota_limit"],
+                        help="Quota units per API key, then every request fails with quotaExceeded.\n",
+                        metavar="UNITS")
+    parser.add_argument("--page-size", dest="page_size", type=int, default=DEFAULT_CONFIG["page_size"],
+                        help="Maximum number of items in one page.\n", metavar="N")
+    parser.add_argument("--items", dest="items", type=int, default=DEFAULT_CONFIG["items"],
+                        help="Number of videos in every channel and playlist.\n", metavar="N")
+    parser.add_argument("--live-rate", dest="live_rate", type=float, default=DEFAULT_CONFIG["live_rate"],
+                        help="Fraction of upcoming or live videos.\n", metavar="RATE")
+    parser.add_argument("--media-size", dest="media_size", type=int, default=DEFAULT_CONFIG["media_size"],
+                        help="Size of every /videoplayback media file in bytes.\n", metavar="BYTES")
+    parser.add_argument("--media-drop-after", dest="media_drop_after", type=int,
+                        default=DEFAULT_CONFIG["media_drop_after"],
+                        help="Drop /videoplayback connections after BYTES body bytes.\n", metavar="BYTES")
+    parser.add_argument("--thumbnail-version", dest="thumbnail_version", type=int,
+                        default=DEFAULT_CONFIG["thumbnail_version"],
+                        help="Change to replace every thumbnail with a different image.\n", metavar="N")
+    parser.add_argument("--thumbnail-error-page", dest="thumbnail_error_page", action="store_true",
+                        help="Answer thumbnail requests with a 200 HTML page.\n")
+    parser.add_argument("--seed", dest="seed", type=int, default=DEFAULT_CONFIG["seed"],
+                        help="Seed of the injected errors and delays.\n", metavar="N")
+
+
+def configFromOptions(opts):
+    return dict((name, getattr(opts, name)) for name in DEFAULT_CONFIG)
+
+
+if __name__ == "__main__":
+    program_usage = "fakeyoutube [OPTIONS]"
+    program_longdesc = "Local fake YouTube Data API server"
+    parser = argparse.ArgumentParser(usage=program_usage, description=program_longdesc,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--host", dest="host", default="127.0.0.1", help="Address to listen on.\n")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=8090, help="Port to listen on.\n")
+    addConfigArguments(parser)
+    opts = parser.parse_args(sys.argv[1:])
+
+    server = FakeYoutubeServer((opts.host, opts.port), configFromOptions(opts))
+    print("Fake YouTube API on {0}".format(server.api_endpoint))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -9,10 +9,13 @@ import urllib
 import urllib.parse
 import mimetypes
 import argparse
+import json
 from xml.sax import saxutils
 import locale
 import os
+import socket
 import sys
+import threading
 import urllib.parse
 from requests.utils import requote_uri
 
@@ -381,37 +384,211 @@ def fileToItem(host, fname, pubDate, use_metadata=False):
                      pubDate=pubDate, extraTags=[enclosure])
 
 
-def generate(outfile, channel_info, videos):
-    outfp = open(outfile, "w", encoding='utf-8')
-
-    outfp.write(
-        '<?xml version="1.0" encoding="UTF-8"?><rss xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:atom="http://www.w3.org/2005/Atom" version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" xmlns:anchor="https://anchor.fm/xmlns">\n')
-    outfp.write('   <channel>\n')
-    outfp.write('      <atom:link href="{0}" rel="self" type="application/rss+xml" />\n'.format(channel_info["link"]))
-    outfp.write('      <title>{0}</title>\n'.format(saxutils.escape(channel_info["title"].encode('utf-8', 'replace').decode())))
-    outfp.write('      <description>{0}</description>\n'.format(channel_info["desc"]).encode('utf-8', 'replace').decode())
-    outfp.write('      <itunes:author>{0}</itunes:author>\n'.format(channel_info["author"].encode('utf-8', 'replace').decode()))
-    outfp.write('      <link>{0}</link>\n'.format(channel_info["link"]))
-
-    outfp.write("      <image>\n")
-    outfp.write("         <url>{0}</url>\n".format(channel_info["imgurl"]))
-    outfp.write("         <title>{0}</title>\n".format(saxutils.escape(channel_info["title"])))
-    outfp.write("         <link>{0}</link>\n".format(channel_info["link"]))
-    outfp.write("      </image>\n")
-    outfp.write('      <itunes:image href="{0}"/>\n'.format(channel_info["imgurl"]))
+def buildChannelHeader(channel_info, indent="   "):
+    '''
+    Generate the RSS 2 preamble and channel elements (everything before the first item)
+    and return it as a string. Strings that appear more than once are escaped only once.
+    Parameters
+    ----------
+    channel_info : dict
+                   Channel description with the keys "title", "desc", "author", "link" and "imgurl".
+    indent : string
+             A string of white spaces used to indent the elements of the channel.
+    Returns
+    -------
+    A string with the XML declaration, the opening <rss> and <channel> tags and the channel elements.
+    Examples
+    --------
+    >>> print(buildChannelHeader({"title": "A & B", "desc": "<b>news</b>", "author": "A & B",
+    ...                           "link": "https://www.youtube.com/channel/UC1",
+    ...                           "imgurl": "https://example.com/i.jpg?a=1&b=2"}).split("\\n", 1)[1], end="")
+       <channel>
+          <atom:link href="https://www.youtube.com/channel/UC1" rel="self" type="application/rss+xml" />
+          <title>A &amp; B</title>
+          <description>&lt;b&gt;news&lt;/b&gt;</description>
+          <itunes:author>A &amp; B</itunes:author>
+          <link>https://www.youtube.com/channel/UC1</link>
+          <image>
+             <url>https://example.com/i.jpg?a=1&amp;b=2</url>
+             <title>A &amp; B</title>
+             <link>https://www.youtube.com/channel/UC1</link>
+          </image>
+          <itunes:image href="https://example.com/i.jpg?a=1&amp;b=2"/>
+    '''
+    title = saxutils.escape(channel_info["title"].encode('utf-8', 'replace').decode())
+    desc = saxutils.escape(channel_info["desc"].encode('utf-8', 'replace').decode())
+    author = saxutils.escape(channel_info["author"].encode('utf-8', 'replace').decode())
+    link = saxutils.escape(channel_info["link"])
+    link_attr = saxutils.escape(channel_info["link"], {'"': "&quot;"})
+    imgurl = saxutils.escape(channel_info["imgurl"])
+    imgurl_attr = saxutils.escape(channel_info["imgurl"], {'"': "&quot;"})
+
+    header = '<?xml version="1.0" encoding="UTF-8"?><rss xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:atom="http://www.w3.org/2005/Atom" version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" xmlns:anchor="https://anchor.fm/xmlns">\n'
+    header += '{0}<channel>\n'.format(indent)
+    header += '{0}<atom:link href="{1}" rel="self" type="application/rss+xml" />\n'.format(indent * 2, link_attr)
+    header += '{0}<title>{1}</title>\n'.format(indent * 2, title)
+    header += '{0}<description>{1}</description>\n'.format(indent * 2, desc)
+    header += '{0}<itunes:author>{1}</itunes:author>\n'.format(indent * 2, author)
+    header += '{0}<link>{1}</link>\n'.format(indent * 2, link)
+
+    header += "{0}<image>\n".format(indent * 2)
+    header += "{0}<url>{1}</url>\n".format(indent * 3, imgurl)
+    header += "{0}<title>{1}</title>\n".format(indent * 3, title)
+    header += "{0}<link>{1}</link>\n".format(indent * 3, link)
+    header += "{0}</image>\n".format(indent * 2)
+    header += '{0}<itunes:image href="{1}"/>\n'.format(indent * 2, imgurl_attr)
+    return header
+
+
+def render(channel_info, videos):
+    '''
+    Render a whole RSS 2 feed for a channel or playlist and return it as a string.
+    Parameters
+    ----------
+    channel_info : dict
+                   Channel description, see buildChannelHeader.
+    videos : list of dict
+             Videos with the keys "videoId", "title", "desc", "published", "url" and "image".
+    Returns
+    -------
+    A string representing the whole feed.
+    '''
+    parts = [buildChannelHeader(channel_info)]
 
     for video in videos:
-        outfp.write(buildItem(link="https://www.youtube.com/watch?v=" + video["videoId"], title=video["title"],
-                              guid=video["videoId"], description=video["desc"],
-                              pubDate=video["published"], url=video["url"], image=video["image"]).encode('utf-8', 'replace').decode() + "\n",)
+        parts.append(buildItem(link="https://www.youtube.com/watch?v=" + video["videoId"], title=video["title"],
+                               guid=video["videoId"], description=video["desc"],
+                               pubDate=video["published"], url=video["url"], image=video["image"]).encode('utf-8', 'replace').decode() + "\n")
 
-    # for item in items:
-    #     outfp.write(item.encode('utf-8', 'replace').decode() + "\n")
+    parts.append('   </channel>\n')
+    parts.append('</rss>\n')
+    return "".join(parts)
 
-    outfp.write('')
-    outfp.write('   </channel>\n')
-    outfp.write('</rss>\n')
+
+def generate(outfile, channel_info, videos):
+    outfp = open(outfile, "w", encoding='utf-8')
+    outfp.write(render(channel_info, videos))
 
     if outfp != sys.stdout:
         outfp.close()
-    print("Generating RSS")
\ No newline at end of file
+    print("Generating RSS")
+
+
+def buildOpml(entries, title="Youtube RSS Generator", base_url=None):
+    '''
+    Generate an OPML 2.0 subscription list for the given index entries and return it as a string.
+    Parameters
+    ----------
+    entries : list of dict
+              Index entries as returned by generateAll.
+    title : string
+            Title of the OPML document.
+    base_url : string
+               Public URL of the directory the feeds are served from; xmlUrl is base_url + the
+               file name of the feed. Podcast apps importing the OPML file need absolute URLs.
+               Default = None (xmlUrl is the bare file name).
+    Returns
+    -------
+    A string representing the OPML document.
+    Examples
+    --------
+    >>> print(buildOpml([{"id": "PL1", "title": "A & B", "file": "PL1.rss", "link": "https://www.youtube.com/playlist?list=PL1"}],
+    ...                 title="Feeds", base_url="https://example.com/generated"), end="")
+    <?xml version="1.0" encoding="UTF-8"?>
+    <opml version="2.0">
+       <head>
+          <title>Feeds</title>
+       </head>
+       <body>
+          <outline type="rss" text="A &amp; B" title="A &amp; B" xmlUrl="https://example.com/generated/PL1.rss" htmlUrl="https://www.youtube.com/playlist?list=PL1"/>
+       </body>
+    </opml>
+    '''
+    if base_url is not None and base_url[-1] != "/":
+        base_url += "/"
+    outlines = ""
+    for entry in entries:
+        text = saxutils.quoteattr(entry["title"])
+        xml_url = entry["file"] if base_url is None else base_url + entry["file"]
+        outlines += '      <outline type="rss" text={0} title={0} xmlUrl={1} htmlUrl={2}/>\n'.format(
+            text, saxutils.quoteattr(xml_url), saxutils.quoteattr(entry["link"]))
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<opml version="2.0">\n'
+            '   <head>\n'
+            '      <title>{0}</title>\n'
+            '   </head>\n'
+            '   <body>\n'
+            '{1}'
+            '   </body>\n'
+            '</opml>\n').format(saxutils.escape(title), outlines)
+
+
+def generateAll(outdir, feeds, opml_name="feeds.opml", index_name="feeds.json", listed=None, base_url=None):
+    '''
+    Render every feed into outdir and, in the same pass, write an OPML subscription list and
+    a JSON index describing the rendered feeds, so the front end does not have to scan outdir.
+    Parameters
+    ----------
+    outdir : string
+             Directory the feeds, the OPML file and the index are written to.
+    feeds : list of (channel_info, videos) tuples
+            The fetched feeds, see render.
+    opml_name : string
+                File name of the OPML file inside outdir.
+    index_name : string
+                 File name of the JSON index inside outdir.
+    listed : set of string
+             IDs of all feeds in list.txt. Entries of the existing index with these IDs that
+             are not rendered in this pass, e.g. because fetching them failed or another worker
+             refreshed them, are kept; entries of feeds no longer listed are dropped.
+             Default = None (the index only describes the rendered feeds).
+    base_url : string
+               Public URL of outdir, used for the absolute feed URLs of the OPML file, see buildOpml.
+               The "file" field of the index stays relative. Default = None.
+    Returns
+    -------
+    entries : list of dict
+              One entry per feed with the keys "id", "title", "link", "file", "items",
+              "updated" (ISO 8601, UTC) and "bytes".
+    '''
+    if outdir[-1] != os.sep:
+        outdir += os.sep
+
+    entries = []
+    for channel_info, videos in feeds:
+        fname = channel_info["id"] + ".rss"
+        data = render(channel_info, videos).encode('utf-8')
+        writeAtomic(outdir + fname, data)
+        entries.append({
+            "id": channel_info["id"],
+            "title": channel_info["title"],
+            "link": channel_info["link"],
+            "file": fname,
+            "items": len(videos),
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "bytes": len(data),
+        })
+
+    rendered = len(entries)
+    if listed is not None and os.path.exists(outdir + index_name):
+        ids = set(e["id"] for e in entries)
+        with open(outdir + index_name, encoding='utf-8') as f:
+            entries += [e for e in json.load(f)["feeds"] if e["id"] not in ids and e["id"] in listed]
+
+    entries.sort(key=lambda e: e["title"].lower())
+    writeAtomic(outdir + opml_name, buildOpml(entries, base_url=base_url).encode('utf-8'))
+    writeAtomic(outdir + index_name, json.dumps({"feeds": entries}, ensure_ascii=False, indent=1).encode('utf-8'))
+    print("Generated {0} feeds, {1} in the index".format(rendered, len(entries)))
+    return entries
+
+
+def writeAtomic(path, data):
+    '''
+    Write bytes to path through a temporary file in the same directory, so readers never see
+    a partially written file.
+    '''
+    tmp = "{0}.{1}.{2}.{3}.tmp".format(path, socket.gethostname(), os.getpid(), threading.get_ident())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import argparse
 import os
 import sys
 import threading
@@ -9,6 +10,7 @@ from datetime import datetime as dt
 from urllib import parse
 from urllib.parse import urlparse
 import random
+import time
 from requests.utils import requote_uri
 
 import googleapiclient.discovery
@@ -18,15 +20,63 @@ from pytube import YouTube
 import traceback
 
 import generator
+import sharding
 import sys
-
-from apiKey import apiKeyList
-from apiKey import doenload_php_link
+import thumbnails
+
+program_usage = "getvideos [OPTIONS]"
+program_longdesc = "Youtube RSS generator"
+parser = argparse.ArgumentParser(usage=program_usage, description=program_longdesc,
+                                 formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument("--catalog", dest="catalog",
+                    help="Directory with list.txt, apiKey.py and generated/.\n"
+                         "Default: directory of this script.", metavar="DIR")
+parser.add_argument("--api-endpoint", dest="api_endpoint",
+                    help="Base URL of the YouTube Data API, e.g. http://127.0.0.1:8090/\n"
+                         "for a local fakeyoutube.py server. Default: the real API.", metavar="URL")
+parser.add_argument("--shard", dest="shard", action="store_true",
+                    help="Refresh only this worker's share of list.txt. Several workers (processes or\n"
+                         "hosts) sharing the state directory split the feeds between them.")
+parser.add_argument("--worker-id", dest="worker_id",
+                    help="Unique name of this worker. Default: hostname-pid.", metavar="ID")
+parser.add_argument("--state-dir", dest="state_dir",
+                    help="Shared directory with worker heartbeats and feed leases.\n"
+                         "Default: generated/.shards in the catalog.", metavar="DIR")
+parser.add_argument("--lease-ttl", dest="lease_ttl", type=int, default=900,
+                    help="Seconds after which the feeds of a worker that stopped renewing\n"
+                         "its leases are taken over. Default: 900.", metavar="SEC")
+parser.add_argument("--min-interval", dest="min_interval", type=int, default=600,
+                    help="Skip feeds refreshed by any worker less than SEC seconds ago. Default: 600.",
+                    metavar="SEC")
+parser.add_argument("--settle", dest="settle", type=float, default=5,
+                    help="Seconds to wait for workers started at the same time to register\n"
+                         "before splitting the feeds. Default: 5.", metavar="SEC")
+parser.add_argument("--feed-base-url", dest="feed_base_url",
+                    help="Public address of generated/, used for the absolute feed URLs in\n"
+                         "feeds.opml, e.g. https://example.com/youtube_rss/generated/\n"
+                         "Default: feed file names relative to feeds.opml.", metavar="URL")
+parser.add_argument("--thumbnail-base-url", dest="thumbnail_base_url",
+                    help="Mirror the channel and video thumbnails into generated/thumbs/ and point\n"
+                         "the feeds at them. URL is the public address of generated/,\n"
+                         "e.g. https://example.com/youtube_rss/generated/", metavar="URL")
+parser.add_argument("--thumbnail-sizes", dest="thumbnail_sizes", default="320",
+                    help="Comma separated longest sides of the resized thumbnail variants;\n"
+                         "the feeds use the first one. Default: 320.", metavar="PX")
+parser.add_argument("--thumbnail-ttl", dest="thumbnail_ttl", type=float, default=86400,
+                    help="Seconds after which a mirrored thumbnail is checked for changes.\n"
+                         "Default: 86400.", metavar="SEC")
+opts = parser.parse_args(sys.argv[1:])
 
 catalog_path = os.path.dirname(sys.argv[0])
+if opts.catalog is not None:
+    catalog_path = opts.catalog.rstrip("/")
+    sys.path.insert(0, catalog_path)
 if catalog_path != "":
     catalog_path += "/"
 
+from apiKey import apiKeyList
+from apiKey import doenload_php_link
+
 print("STARTING...")
 
 
@@ -35,8 +85,8 @@ def htmlspecialchars(content):
                                                                                                                     "&gt;")
 
 
-def getVideosIds(key, channel_id, playlist_id=None, title_filter=None, limit=50):
-    youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=key)
+def getVideosIds(key, channel_id, playlist_id=None, title_filter=None, limit=50, results=None):
+    youtube = buildYoutube(key)
 
     if playlist_id is None:
         channel_info = getChannelInfo(channel_id, youtube)
@@ -119,15 +169,48 @@ def getVideosIds(key, channel_id, playlist_id=None, title_filter=None, limit=50)
     # except:
     #     print("Something went wrong  with {0}".format(item))
 
+    if results is not None:
+        # rendered later, together with the other feeds, by renderFeeds
+        results.append((channel_info, videos))
+        return
+
+    generator.generate(getGeneratedPath() + channel_info["id"] + ".rss", channel_info, videos)
+
+
+def getGeneratedPath():
     generated_catalog_path = catalog_path + "generated/"
     # Check whether the specified path exists or not
     isExist = os.path.exists(generated_catalog_path)
     if not isExist:
         # Create a new directory because it does not exist
-        os.makedirs(generated_catalog_path)
+        os.makedirs(generated_catalog_path, exist_ok=True)
         print("The new directory is created! " + generated_catalog_path)
+    return generated_catalog_path
+
+
+def mirrorThumbnails(results, index_lock=None):
+    if opts.thumbnail_base_url is None:
+        return
+    sizes = [int(size) for size in opts.thumbnail_sizes.split(",") if size.strip()]
+    mirror = thumbnails.ThumbnailMirror(getGeneratedPath(), opts.thumbnail_base_url, sizes, ttl=opts.thumbnail_ttl)
+    mirror.rewrite(results, index_lock)
+
 
-    generator.generate(generated_catalog_path + channel_info["id"] + ".rss", channel_info, videos)
+def listedIds(job_list):
+    # IDs the feeds of list.txt are generated under, see generator.generateAll
+    return set(item["playlist"] if item["playlist"] is not None else item["channel"] for item in job_list)
+
+
+def renderFeeds(results, listed=None):
+    # one pass over all fetched feeds: RSS files, feeds.opml and feeds.json
+    generator.generateAll(getGeneratedPath(), results, listed=listed, base_url=opts.feed_base_url)
+
+
+def buildYoutube(key):
+    if opts.api_endpoint is None:
+        return googleapiclient.discovery.build("youtube", "v3", developerKey=key)
+    return googleapiclient.discovery.build("youtube", "v3", developerKey=key,
+                                           client_options={"api_endpoint": opts.api_endpoint})
 
 
 def getItemsForChannel(channel_id, youtube):
@@ -274,27 +357,78 @@ def loadLinkToGenerate():
     return list
 
 
+def refresh(job_list):
+    # fetch all feeds in parallel, returns the fetched (channel_info, videos) of every item
+    fetched = [[] for item in job_list]
+    threads = []
+    for item, results in zip(job_list, fetched):
+        i = 0
+        try:
+            i = random.randint(0, len(apiKeyList) - 1)
+            # getVideosIds(apiKeyList[i], channel_id=item["channel"], playlist_id=item["playlist"],
+            #              title_filter=item["filter"])
+            x = threading.Thread(target=getVideosIds, args=(apiKeyList[i], item["channel"], item["playlist"],
+                                                            item["filter"]), kwargs={"results": results})
+            x.start()
+            threads.append(x)
+            # x.join()
+        except HttpError as err:
+            try:
+                print("An exception occurred: {0}".format(err))
+                i = (i + 1) % len(apiKeyList)
+                getVideosIds(apiKeyList[i], channel_id=item["channel"], playlist_id=item["playlist"],
+                             title_filter=item["filter"], results=results)
+            except:
+                print("An exception occurred: {0}".format(err))
+                continue
+
+    for x in threads:
+        x.join()
+    return fetched
+
+
+def refreshShard(job_list):
+    state_dir = opts.state_dir
+    if state_dir is None:
+        state_dir = getGeneratedPath() + ".shards"
+    worker = sharding.Worker(state_dir, opts.worker_id, ttl=opts.lease_ttl, min_interval=opts.min_interval)
+    worker.start()
+    try:
+        time.sleep(opts.settle)
+        # feeds of a worker that crashed stay leased until --lease-ttl has passed,
+        # they are taken over by the first run of another worker after that
+        claimed = worker.claim(job_list)
+        print("WORKER {0}: {1} of {2} feeds".format(worker.worker_id, len(claimed), len(job_list)))
+
+        results = []
+        done = []
+        for item, feed_results in zip(claimed, refresh(claimed)):
+            key = sharding.feedKey(item)
+            if len(feed_results) > 0 and worker.holds(key):
+                results += feed_results
+                done.append(key)
+            else:
+                worker.release(key)
+
+        mirrorThumbnails(results, worker.exclusive("thumbs"))
+        with worker.exclusive("index"):
+            renderFeeds(results, listed=listedIds(job_list))
+        for key in done:
+            worker.release(key, done=True)
+    finally:
+        worker.stop()
+
+
 print("LETS GO")
 job_list = loadLinkToGenerate()
 random.shuffle(job_list)
 print(job_list)
 
-for item in job_list:
-    i = 0
-    try:
-        i = random.randint(0, len(apiKeyList) - 1)
-        # getVideosIds(apiKeyList[i], channel_id=item["channel"], playlist_id=item["playlist"],
-        #              title_filter=item["filter"])
-        x = threading.Thread(target=getVideosIds, args=(apiKeyList[i], item["channel"], item["playlist"],
-                                                        item["filter"]))
-        x.start()
-        # x.join()
-    except HttpError as err:
-        try:
-            print("An exception occurred: {0}".format(err))
-            i = (i + 1) % len(apiKeyList)
-            getVideosIds(apiKeyList[i], channel_id=item["channel"], playlist_id=item["playlist"],
-                         title_filter=item["filter"])
-        except:
-            print("An exception occurred: {0}".format(err))
-            continue
+if opts.shard:
+    refreshShard(job_list)
+else:
+    results = []
+    for feed_results in refresh(job_list):
+        results += feed_results
+    mirrorThumbnails(results)
+    renderFeeds(results, listed=listedIds(job_list))
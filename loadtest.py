@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Offline load test of getvideos.py.
+
+Starts a fakeyoutube.py server, writes a synthetic catalog (list.txt with thousands of
+channel and playlist feeds plus an apiKey.py with fake keys), runs getvideos.py against
+it exactly as run.php does and reports wall time, API traffic and generated feeds.
+No real API quota is used.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+
+import fakeyoutube
+
+program_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def writeCatalog(catalog, feeds, playlist_ratio=0.5, filter_ratio=0.1, keys=3, download_link="http://localhost/dl.php"):
+    '''
+    Write list.txt and apiKey.py for a synthetic run into catalog and return the number of feeds.
+    The IDs only use upper case letters and digits at both ends, so the list.txt parser of
+    getvideos.py keeps them intact.
+    '''
+    lines = ["# synthetic list.txt generated by loadtest.py"]
+    playlists = int(feeds * playlist_ratio)
+    filtered = int((feeds - playlists) * filter_ratio)
+    for i in range(playlists):
+        lines.append("https://www.youtube.com/watch?v=V{0:010d}&list=PLLOAD{0:016d}".format(i))
+    for i in range(feeds - playlists):
+        line = "https://www.youtube.com/channel/UCLOAD{0:016d}".format(i)
+        if i < filtered:
+            line += "?filter=video 1"
+        lines.append(line)
+
+    with open(os.path.join(catalog, "list.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+    with open(os.path.join(catalog, "apiKey.py"), "w", encoding="utf-8") as f:
+        f.write("apiKeyList = {0!r}\n".format(["fake-key-{0}".format(i) for i in range(keys)]))
+        f.write("doenload_php_link = {0!r}\n".format(download_link))
+    return feeds
+
+
+def runGenerator(catalog, api_endpoint, timeout=None):
+    '''
+    Run getvideos.py on catalog against api_endpoint, log its output to catalog/getvideos.log
+    and return (exit code, wall time in seconds). The exit code is "timeout" when getvideos.py
+    was killed after timeout seconds.
+    '''
+    env = dict(os.environ)
+    env["PYTHONIOENCODING"] = "utf8"
+    command = [sys.executable, os.path.join(program_path, "getvideos.py"),
+               "--catalog", catalog, "--api-endpoint", api_endpoint]
+    start = time.time()
+    with open(os.path.join(catalog, "getvideos.log"), "w", encoding="utf-8") as log:
+        try:
+            code = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT, env=env, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # subprocess.call has killed getvideos.py already
+            code = "timeout"
+    return code, time.time() - start
+
+
+def invalidFeeds(generated, rss_files):
+    '''
+    Parse every generated feed and return the names of those that are not well-formed XML.
+    '''
+    invalid = []
+    for name in rss_files:
+        try:
+            minidom.parse(os.path.join(generated, name))
+        except ExpatError as e:
+            invalid.append("{0} ({1})".format(name, e))
+    return invalid
+
+
+def report(feeds, code, elapsed, stats, catalog):
+    generated = os.path.join(catalog, "generated")
+    rss_files = []
+    if os.path.isdir(generated):
+        rss_files = sorted(f for f in os.listdir(generated) if f.endswith(".rss"))
+    invalid = invalidFeeds(generated, rss_files)
+    indexed = 0
+    index_file = os.path.join(generated, "feeds.json")
+    if os.path.exists(index_file):
+        with open(index_file, encoding="utf-8") as f:
+            indexed = len(json.load(f)["feeds"])
+
+    requests = sum(stats["requests"].values())
+    print("feeds in list.txt   : {0}".format(feeds))
+    print("exit code           : {0}".format(code))
+    print("wall time           : {0:.2f} s ({1:.1f} feeds/s)".format(elapsed, feeds / elapsed if elapsed else 0))
+    print("rss files generated : {0}".format(len(rss_files)))
+    print("invalid rss files   : {0}".format(len(invalid)))
+    for name in invalid[:10]:
+        print("    " + name)
+    print("feeds in feeds.json : {0}".format(indexed))
+    print("api requests        : {0} ({1})".format(requests, ", ".join(
+        "{0}={1}".format(k, v) for k, v in sorted(stats["requests"].items()))))
+    print("injected errors     : {0} server, {1} quota".format(stats["errors"], stats["quota_errors"]))
+    print("quota units used    : {0}".format(sum(stats["quota_used"].values())))
+    print("log                 : {0}".format(os.path.join(catalog, "getvideos.log")))
+
+
+if __name__ == "__main__":
+    program_usage = "loadtest [OPTIONS]"
+    program_longdesc = "Load test getvideos.py against a local fake YouTube API"
+    parser = argparse.ArgumentParser(usage=program_usage, description=program_longdesc,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-n", "--feeds", dest="feeds", type=int, default=1000,
+                        help="Number of synthetic feeds in list.txt.\n", metavar="N")
+    parser.add_argument("--playlist-ratio", dest="playlist_ratio", type=float, default=0.5,
+                        help="Fraction of playlist feeds, the rest are channels.\n", metavar="RATE")
+    parser.add_argument("--filter-ratio", dest="filter_ratio", type=float, default=0.1,
+                        help="Fraction of channel feeds with a title filter.\n", metavar="RATE")
+    parser.add_argument("--keys", dest="keys", type=int, default=3,
+                        help="Number of fake API keys.\n", metavar="N")
+    parser.add_argument("--workdir", dest="workdir",
+                        help="Catalog directory to use. Default: a new temporary directory,\n"
+                             "removed after the run unless --keep is given.\n", metavar="DIR")
+    parser.add_argument("--keep", dest="keep", action="store_true",
+                        help="Keep the temporary catalog directory.\n")
+    parser.add_argument("--timeout", dest="timeout", type=float,
+                        help="Kill getvideos.py after SEC seconds.\n", metavar="SEC")
+    fakeyoutube.addConfigArguments(parser)
+    opts = parser.parse_args(sys.argv[1:])
+
+    catalog = opts.workdir
+    if catalog is None:
+        catalog = tempfile.mkdtemp(prefix="ytrss-load-")
+    else:
+        os.makedirs(catalog, exist_ok=True)
+
+    server = fakeyoutube.start(config=fakeyoutube.configFromOptions(opts))
+    try:
+        feeds = writeCatalog(catalog, opts.feeds, opts.playlist_ratio, opts.filter_ratio, opts.keys)
+        print("Running getvideos.py on {0} feeds against {1}".format(feeds, server.api_endpoint))
+        code, elapsed = runGenerator(catalog, server.api_endpoint, opts.timeout)
+        report(feeds, code, elapsed, server.fake.getStats(), catalog)
+    finally:
+        server.shutdown()
+        if opts.workdir is None and not opts.keep:
+            shutil.rmtree(catalog, ignore_errors=True)
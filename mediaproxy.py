@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Optional streaming proxy for the enclosure URLs (doenload_php_link?vid=VIDEO_ID).
+
+Instead of redirecting podcast apps to a short-lived googlevideo URL, the proxy resolves
+the video with getlink.py and streams the media itself:
+
+- single byte ranges are passed through, so apps can seek and resume downloads,
+- data is relayed in chunks of a fixed size, memory per download stays bounded,
+- upstream connections are pooled and reused,
+- resolved URLs are cached until they expire; when upstream rejects an expired URL or
+  drops the connection mid-download, the video is resolved again and the download
+  continues from the last byte sent.
+
+For testing, --resolver-template replaces getlink.py, e.g. with the /videoplayback
+endpoint of fakeyoutube.py or any other local server that supports ranges.
+'''
+
+import argparse
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# upstream answers meaning the resolved URL is not valid (any more)
+EXPIRED_STATUSES = (401, 403, 404, 410)
+
+# headers copied from the upstream response
+FORWARDED_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "Last-Modified", "ETag")
+
+
+class ResolveError(Exception):
+    pass
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def templateResolver(template, ttl=3600):
+    '''
+    Return a resolver formatting template with {vid} and {expire} (now + ttl, unix time).
+    '''
+    def resolve(video_id):
+        return template.format(vid=parse.quote(video_id), expire=int(time.time() + ttl))
+    return resolve
+
+
+def getlinkResolver(video_id):
+    import getlink
+    return getlink.getStreamUrl(video_id)
+
+
+def urlExpiry(url, default):
+    '''
+    Return the expiry time (unix time) of a resolved URL, taken from its "expire" query
+    parameter as used by googlevideo URLs, or default.
+    >>> urlExpiry("https://r1.googlevideo.com/videoplayback?expire=1700000000&id=x", 5)
+    1700000000.0
+    >>> urlExpiry("http://127.0.0.1/video.mp4", 5)
+    5
+    '''
+    try:
+        return float(parse.parse_qs(parse.urlparse(url).query)["expire"][0])
+    except (KeyError, ValueError):
+        return default
+
+
+def parseContentRange(value):
+    '''
+    Parse a Content-Range header and return (start, end, total); total is None when unknown.
+    >>> parseContentRange("bytes 100-199/1000")
+    (100, 199, 1000)
+    >>> parseContentRange("bytes 0-9/*")
+    (0, 9, None)
+    '''
+    try:
+        unit, _, rest = value.strip().partition(" ")
+        span, _, total = rest.partition("/")
+        start, _, end = span.partition("-")
+        return int(start), int(end), None if total == "*" else int(total)
+    except (AttributeError, ValueError):
+        return None
+
+
+class MediaProxy(object):
+    '''
+    Resolver cache and upstream connection pool shared by all request handlers.
+    '''
+
+    def __init__(self, resolver, chunk_size=1 << 16, pool_size=10, max_resolves=3, url_ttl=3600, timeout=30):
+        self.resolver = resolver
+        self.chunk_size = chunk_size
+        self.max_resolves = max_resolves
+        self.url_ttl = url_ttl
+        self.timeout = timeout
+        self.cache = {}
+        self.resolving = {}  # video_id -> [lock held while the video is resolved, number of users]
+        self.evicted = time.time()
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def cached(self, video_id):
+        with self.lock:
+            cached = self.cache.get(video_id)
+        # keep a margin, a URL about to expire would fail in the middle of the download
+        if cached is not None and cached[1] > time.time() + 60:
+            return cached[0]
+        return None
+
+    def resolve(self, video_id):
+        url = self.cached(video_id)
+        if url is not None:
+            return url
+
+        self.evict()
+        with self.lock:
+            resolving = self.resolving.setdefault(video_id, [threading.Lock(), 0])
+            resolving[1] += 1
+        try:
+            # podcast apps open several ranges at once, resolve every video only once at a time
+            with resolving[0]:
+                url = self.cached(video_id)
+                if url is not None:
+                    return url
+                try:
+                    url = self.resolver(video_id)
+                except Exception as e:
+                    traceback.print_exc()
+                    raise ResolveError("Cannot resolve {0}: {1}".format(video_id, e))
+                if url is None:
+                    raise ResolveError("No stream found for {0}".format(video_id))
+
+                with self.lock:
+                    self.cache[video_id] = (url, urlExpiry(url, time.time() + self.url_ttl))
+                return url
+        finally:
+            with self.lock:
+                resolving[1] -= 1
+
+    def evict(self, interval=60):
+        '''
+        Drop expired URLs and unused resolver locks, at most every interval seconds.
+        '''
+        now = time.time()
+        with self.lock:
+            if now - self.evicted < interval:
+                return
+            self.evicted = now
+            for video_id in [v for v, (url, expiry) in self.cache.items() if expiry <= now]:
+                del self.cache[video_id]
+            for video_id in [v for v, (lock, users) in self.resolving.items() if users == 0]:
+                del self.resolving[video_id]
+
+    def invalidate(self, video_id, url):
+        with self.lock:
+            if self.cache.get(video_id, (None,))[0] == url:
+                del self.cache[video_id]
+
+    def open(self, video_id, range_header=None):
+        '''
+        Open a streaming upstream request for video_id, resolving the video again
+        when the cached URL is rejected or unreachable.
+        '''
+        for attempt in range(self.max_resolves):
+            url = self.resolve(video_id)
+            headers = {"Accept-Encoding": "identity"}
+            if range_header is not None:
+                headers["Range"] = range_header
+            try:
+                response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+            except requests.RequestException as e:
+                print("{0}: upstream request failed: {1}".format(video_id, e))
+                self.invalidate(video_id, url)
+                continue
+            if response.status_code in EXPIRED_STATUSES or response.status_code >= 500:
+                print("{0}: upstream answered {1}, resolving again".format(video_id, response.status_code))
+                response.close()
+                self.invalidate(video_id, url)
+                continue
+            return response
+        raise UpstreamError("Upstream failed {0} times for {1}".format(self.max_resolves, video_id))
+
+
+class MediaProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.proxy(send_body=True)
+
+    def do_HEAD(self):
+        self.proxy(send_body=False)
+
+    def proxy(self, send_body):
+        media = self.server.media
+        params = parse.parse_qs(parse.urlparse(self.path).query)
+        video_id = params.get("vid", [None])[0]
+        if not video_id:
+            return self.sendError(400, "Missing vid parameter")
+
+        # multiple ranges are not supported, answering with the whole file is allowed
+        range_header = self.headers.get("Range")
+        if range_header is not None and (not range_header.startswith("bytes=") or "," in range_header):
+            range_header = None
+
+        try:
+            response = media.open(video_id, range_header)
+        except (ResolveError, UpstreamError) as e:
+            return self.sendError(502, str(e))
+
+        if response.status_code not in (200, 206):
+            # e.g. 416 Range Not Satisfiable, pass it on without a body
+            self.send_response(response.status_code)
+            if "Content-Range" in response.headers:
+                self.send_header("Content-Range", response.headers["Content-Range"])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            response.close()
+            return
+
+        start, end = 0, None
+        if response.status_code == 206:
+            content_range = parseContentRange(response.headers.get("Content-Range"))
+            if content_range is None:
+                response.close()
+                return self.sendError(502, "Invalid Content-Range from upstream")
+            start, end = content_range[:2]
+        elif "Content-Length" in response.headers:
+            end = int(response.headers["Content-Length"]) - 1
+
+        self.send_response(response.status_code)
+        for name in FORWARDED_HEADERS:
+            if name in response.headers:
+                self.send_header(name, response.headers[name])
+        self.send_header("Accept-Ranges", "bytes")
+        if "Content-Length" not in response.headers:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+
+        if not send_body:
+            response.close()
+            return
+        self.relay(video_id, response, start, end)
+
+    def relay(self, video_id, response, start, end):
+        '''
+        Copy the upstream body to the client chunk by chunk. When upstream fails before
+        byte end was sent, reopen it from the next byte and continue; give up after
+        max_resolves reopens in a row that did not send a single byte.
+        '''
+        media = self.server.media
+        position = start
+        resumes = 0
+        resumed_at = position
+        skip = 0
+        while True:
+            try:
+                for chunk in response.iter_content(media.chunk_size):
+                    if skip:
+                        # upstream ignored the resume range and started from the beginning
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                    if end is not None:
+                        chunk = chunk[:end + 1 - position]
+                    if chunk:
+                        self.wfile.write(chunk)
+                        position += len(chunk)
+                    if end is not None and position > end:
+                        break
+                response.close()
+                if end is None or position > end:
+                    return
+                print("{0}: upstream ended at byte {1} of {2}".format(video_id, position, end + 1))
+            except (BrokenPipeError, ConnectionResetError):
+                # client went away
+                response.close()
+                self.close_connection = True
+                return
+            except requests.RequestException as e:
+                print("{0}: upstream failed at byte {1}: {2}".format(video_id, position, e))
+                response.close()
+
+            # only consecutive reopens that made no progress count against the limit
+            if position > resumed_at:
+                resumes = 0
+            resumed_at = position
+            resumes += 1
+            if resumes > media.max_resolves:
+                self.close_connection = True
+                return
+            try:
+                response = media.open(video_id, "bytes={0}-{1}".format(position, "" if end is None else end))
+            except (ResolveError, UpstreamError) as e:
+                print(e)
+                self.close_connection = True
+                return
+            skip = 0
+            if response.status_code == 200:
+                skip = position
+            elif response.status_code != 206 or \
+                    (parseContentRange(response.headers.get("Content-Range")) or (None,))[0] != position:
+                print("{0}: cannot resume at byte {1}".format(video_id, position))
+                response.close()
+                self.close_connection = True
+                return
+
+    def sendError(self, status, message):
+        data = (message + "\n").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+
+class MediaProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, media):
+        ThreadingHTTPServer.__init__(self, address, MediaProxyHandler)
+        self.media = media
+
+
+if __name__ == "__main__":
+    program_usage = "mediaproxy [OPTIONS]"
+    program_longdesc = "Streaming, range aware media proxy for the enclosure URLs"
+    parser = argparse.ArgumentParser(usage=program_usage, description=program_longdesc,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--host", dest="host", default="127.0.0.1", help="Address to listen on.\n")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=8091, help="Port to listen on.\n")
+    parser.add_argument("--chunk-size", dest="chunk_size", type=int, default=1 << 16,
+                        help="Bytes relayed at once per download.\n", metavar="BYTES")
+    parser.add_argument("--pool-size", dest="pool_size", type=int, default=10,
+                        help="Upstream connections kept open per host.\n", metavar="N")
+    parser.add_argument("--max-resolves", dest="max_resolves", type=int, default=3,
+                        help="Upstream attempts per request, and resumes in a row without progress.\n", metavar="N")
+    parser.add_argument("--url-ttl", dest="url_ttl", type=int, default=3600,
+                        help="Cache time of resolved URLs without an expire parameter.\n", metavar="SEC")
+    parser.add_argument("--timeout", dest="timeout", type=float, default=30,
+                        help="Upstream connect and read timeout.\n", metavar="SEC")
+    parser.add_argument("--resolver-template", dest="resolver_template",
+                        help="Resolve videos by formatting this URL with {vid} and {expire}\n"
+                             "instead of getlink.py, e.g.\n"
+                             "http://127.0.0.1:8090/videoplayback?id={vid}&expire={expire}\n", metavar="URL")
+    opts = parser.parse_args(sys.argv[1:])
+
+    resolver = getlinkResolver
+    if opts.resolver_template is not None:
+        resolver = templateResolver(opts.resolver_template, opts.url_ttl)
+
+    media = MediaProxy(resolver, chunk_size=opts.chunk_size, pool_size=opts.pool_size,
+                       max_resolves=opts.max_resolves, url_ttl=opts.url_ttl, timeout=opts.timeout)
+    server = MediaProxyServer((opts.host, opts.port), media)
+    print("Media proxy on http://{0}:{1}/?vid=VIDEO_ID".format(opts.host, opts.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Sharded refresh of list.txt by several getvideos.py workers (processes or hosts)
+sharing one state directory.
+
+- Every worker writes a heartbeat file; workers with a fresh heartbeat are alive.
+- Feeds are split between the live workers by consistent hashing of the feed key,
+  so a worker joining or leaving only moves its own share of the feeds.
+- Before refreshing a feed the worker takes a lease: a lock file created with O_EXCL.
+  The heartbeat thread renews held leases; a lease not renewed for ttl seconds belongs
+  to a crashed worker and may be taken over, so no feed is refreshed twice at once.
+  Creating and breaking a lease happens under a short-lived per-feed breaker file.
+- A released lease leaves a done marker; feeds refreshed less than min_interval
+  seconds ago are skipped, also when another worker refreshed them.
+
+State directory layout:
+    workers/<worker id>     heartbeat
+    leases/<key hash>       held lease
+    leases/<key hash>.breaker   held while the lease is created or broken
+    done/<key hash>         last successful refresh (mtime)
+'''
+
+import bisect
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+def feedKey(info):
+    '''
+    Return the key of a list.txt entry as parsed by getvideos.loadLinkToGenerate.
+    >>> feedKey({"channel": "UC1", "playlist": None, "filter": "talk"})
+    'channel/UC1?filter=talk'
+    >>> feedKey({"channel": None, "playlist": "PL1", "filter": None})
+    'playlist/PL1'
+    '''
+    if info["playlist"] is not None:
+        key = "playlist/" + info["playlist"]
+    else:
+        key = "channel/{0}".format(info["channel"])
+    if info["filter"] is not None:
+        key += "?filter=" + info["filter"]
+    return key
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest(), 16)
+
+
+def _fileName(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class HashRing(object):
+    '''
+    Consistent hash ring of worker IDs with replicas virtual nodes per worker.
+    >>> ring = HashRing(["a", "b", "c"])
+    >>> owners = [ring.owner("feed{0}".format(i)) for i in range(300)]
+    >>> sorted(set(owners))
+    ['a', 'b', 'c']
+    >>> smaller = HashRing(["a", "b"])
+    >>> all(smaller.owner("feed{0}".format(i)) == o for i, o in enumerate(owners) if o != "c")
+    True
+    '''
+
+    def __init__(self, workers, replicas=100):
+        self.ring = sorted((_hash("{0}#{1}".format(worker, i)), worker)
+                           for worker in set(workers) for i in range(replicas))
+        self.hashes = [h for h, _ in self.ring]
+
+    def owner(self, key):
+        if not self.ring:
+            return None
+        i = bisect.bisect(self.hashes, _hash(key)) % len(self.ring)
+        return self.ring[i][1]
+
+
+class Worker(object):
+    '''
+    One worker of a sharded refresh. Call start() before claim() and stop() at the end.
+    '''
+
+    def __init__(self, state_dir, worker_id=None, ttl=900, min_interval=600):
+        self.state_dir = state_dir
+        self.worker_id = worker_id or "{0}-{1}".format(socket.gethostname(), os.getpid())
+        self.ttl = ttl
+        self.min_interval = min_interval
+        self.held = {}  # key -> token
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        for sub in ("workers", "leases", "done"):
+            os.makedirs(os.path.join(state_dir, sub), exist_ok=True)
+
+    def path(self, sub, name):
+        return os.path.join(self.state_dir, sub, name)
+
+    # heartbeat
+
+    def start(self):
+        self.heartbeat()
+        self.thread = threading.Thread(target=self.renewLoop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.releaseAll()
+        try:
+            os.remove(self.path("workers", self.worker_id))
+        except FileNotFoundError:
+            pass
+
+    def heartbeat(self):
+        with open(self.path("workers", self.worker_id), "w") as f:
+            f.write(json.dumps({"worker": self.worker_id, "host": socket.gethostname(), "pid": os.getpid()}))
+
+    def renewLoop(self):
+        while not self.stopped.wait(self.ttl / 3.0):
+            self.heartbeat()
+            with self.lock:
+                held = list(self.held.items())
+            for key, token in held:
+                if not self.renew(key, token):
+                    print("Lease of {0} was taken over".format(key))
+                    with self.lock:
+                        self.held.pop(key, None)
+
+    def liveWorkers(self):
+        now = time.time()
+        workers = []
+        for name in os.listdir(os.path.join(self.state_dir, "workers")):
+            try:
+                if now - os.path.getmtime(self.path("workers", name)) < self.ttl:
+                    workers.append(name)
+            except FileNotFoundError:
+                pass
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        return workers
+
+    # leases
+
+    def readLease(self, key):
+        path = self.path("leases", _fileName(key))
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path) as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, None
+        try:
+            return json.loads(data), mtime
+        except ValueError:
+            # left half written by a worker that crashed while creating it
+            return {}, mtime
+
+    def acquire(self, key):
+        '''
+        Take the lease of key. Returns False when another worker holds a live lease.
+        Leases are only created and broken while holding the breaker of key, so a stale
+        lease is checked and removed without another worker creating a new one in between.
+        '''
+        path = self.path("leases", _fileName(key))
+        breaker = path + ".breaker"
+        if not self.lockBreaker(breaker):
+            return False
+        try:
+            lease, mtime = self.readLease(key)
+            if mtime is not None:
+                if time.time() - mtime < self.ttl:
+                    return False
+                os.remove(path)
+                print("Took over stale lease of {0} from {1}".format(key, lease.get("worker")))
+
+            token = uuid.uuid4().hex
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps({"worker": self.worker_id, "key": key, "token": token}))
+            with self.lock:
+                self.held[key] = token
+            return True
+        finally:
+            os.remove(breaker)
+
+    def lockBreaker(self, breaker, timeout=10, stale=60):
+        '''
+        Create the breaker file of a lease, waiting up to timeout seconds for another worker
+        to finish with it. Breakers are held for a few file operations only; one older than
+        stale seconds was left by a crashed worker and is removed.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            try:
+                os.close(os.open(breaker, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+                return True
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.path.getmtime(breaker) > stale:
+                    os.remove(breaker)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() > deadline:
+                return False
+            time.sleep(0.05)
+
+    def renew(self, key, token):
+        lease, _ = self.readLease(key)
+        if lease is None or lease.get("token") != token:
+            return False
+        os.utime(self.path("leases", _fileName(key)))
+        return True
+
+    def holds(self, key):
+        with self.lock:
+            token = self.held.get(key)
+        lease, _ = self.readLease(key)
+        return token is not None and lease is not None and lease.get("token") == token
+
+    def release(self, key, done=False):
+        with self.lock:
+            token = self.held.pop(key, None)
+        if token is None:
+            return
+        if done:
+            with open(self.path("done", _fileName(key)), "w") as f:
+                f.write(key)
+        path = self.path("leases", _fileName(key))
+        if not self.lockBreaker(path + ".breaker"):
+            # the lease expires after ttl seconds anyway
+            return
+        try:
+            lease, _ = self.readLease(key)
+            if lease is not None and lease.get("token") == token:
+                os.remove(path)
+        finally:
+            os.remove(path + ".breaker")
+
+    def releaseAll(self):
+        with self.lock:
+            keys = list(self.held)
+        for key in keys:
+            self.release(key)
+
+    def recentlyDone(self, key):
+        try:
+            return time.time() - os.path.getmtime(self.path("done", _fileName(key))) < self.min_interval
+        except FileNotFoundError:
+            return False
+
+    def claim(self, items, key=feedKey):
+        '''
+        Return the items this worker owns on the ring of live workers and holds the lease of,
+        skipping items refreshed less than min_interval seconds ago.
+        '''
+        ring = HashRing(self.liveWorkers())
+        claimed = []
+        for item in items:
+            k = key(item)
+            if ring.owner(k) != self.worker_id or self.recentlyDone(k):
+                continue
+            if self.acquire(k):
+                claimed.append(item)
+        return claimed
+
+    def exclusive(self, name, timeout=None):
+        '''
+        Context manager holding the lease of name, waiting until it is free.
+        '''
+        return _Exclusive(self, name, timeout if timeout is not None else self.ttl)
+
+
+class _Exclusive(object):
+
+    def __init__(self, worker, name, timeout):
+        self.worker = worker
+        self.key = "lock/" + name
+        self.timeout = timeout
+
+    def __enter__(self):
+        deadline = time.time() + self.timeout
+        while not self.worker.acquire(self.key):
+            if time.time() > deadline:
+                raise TimeoutError("Cannot lock {0}".format(self.key))
+            time.sleep(0.2)
+        return self
+
+    def __exit__(self, *exc):
+        self.worker.release(self.key)
+        return False
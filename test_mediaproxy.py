@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Checks of mediaproxy.py against the /videoplayback endpoint of fakeyoutube.py.
+Run with python -m pytest test_mediaproxy.py
+'''
+
+import threading
+import time
+
+import requests
+
+import fakeyoutube
+import mediaproxy
+
+SIZE = 300000
+
+
+def startProxy(config, max_resolves=5):
+    upstream = fakeyoutube.start(config=config)
+    template = upstream.fake.base_url + "/videoplayback?id={vid}&expire={expire}"
+    calls = []
+    resolve = mediaproxy.templateResolver(template)
+
+    def resolver(video_id):
+        calls.append(video_id)
+        return resolve(video_id)
+
+    media = mediaproxy.MediaProxy(resolver, chunk_size=4096, max_resolves=max_resolves)
+    server = mediaproxy.MediaProxyServer(("127.0.0.1", 0), media)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return upstream, server, calls, "http://127.0.0.1:{0}/?vid=abc".format(server.server_address[1])
+
+
+def stop(upstream, server):
+    server.shutdown()
+    upstream.shutdown()
+
+
+def test_resume_after_dropped_upstream():
+    upstream, server, calls, url = startProxy({"media_size": SIZE, "media_drop_after": 100000})
+    try:
+        response = requests.get(url)
+        assert response.status_code == 200
+        assert response.content == fakeyoutube.mediaBytes("abc", 0, SIZE - 1)
+
+        response = requests.get(url, headers={"Range": "bytes=50000-"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 50000-{0}/{1}".format(SIZE - 1, SIZE)
+        assert response.content == fakeyoutube.mediaBytes("abc", 50000, SIZE - 1)
+
+        # every drop is followed by a ranged request from the next byte
+        assert upstream.fake.getStats()["media_requests"] >= 3 + 3
+        assert calls == ["abc"]
+    finally:
+        stop(upstream, server)
+
+
+def test_long_download_survives_more_drops_than_max_resolves():
+    size = 1000000
+    upstream, server, calls, url = startProxy({"media_size": size, "media_drop_after": 200000}, max_resolves=2)
+    try:
+        response = requests.get(url)
+        assert response.status_code == 200
+        assert response.content == fakeyoutube.mediaBytes("abc", 0, size - 1)
+        # four drops, each followed by a reopen that made progress
+        assert upstream.fake.getStats()["media_requests"] >= 5
+    finally:
+        stop(upstream, server)
+
+
+def test_expired_url_is_resolved_again():
+    upstream, server, calls, url = startProxy({"media_size": SIZE})
+    try:
+        # a cached URL the proxy still believes valid, but upstream answers 403
+        expired = upstream.fake.base_url + "/videoplayback?id=abc&expire=1"
+        server.media.cache["abc"] = (expired, time.time() + 3600)
+
+        response = requests.get(url, headers={"Range": "bytes=10-99"})
+        assert response.status_code == 206
+        assert response.content == fakeyoutube.mediaBytes("abc", 10, 99)
+        assert calls == ["abc"]
+        assert server.media.cache["abc"][0] != expired
+    finally:
+        stop(upstream, server)
+
+
+def test_concurrent_requests_resolve_once():
+    calls = []
+
+    def slowResolver(video_id):
+        calls.append(video_id)
+        time.sleep(0.3)
+        return "http://127.0.0.1/{0}.mp4".format(video_id)
+
+    media = mediaproxy.MediaProxy(slowResolver)
+    threads = [threading.Thread(target=media.resolve, args=("abc",)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ["abc"]
+
+
+def test_expired_entries_are_evicted():
+    media = mediaproxy.MediaProxy(lambda video_id: "http://127.0.0.1/{0}.mp4".format(video_id))
+    media.resolve("fresh")
+    media.cache["old"] = ("http://127.0.0.1/old.mp4", time.time() - 1)
+    media.evict(interval=0)
+    assert sorted(media.cache) == ["fresh"]
+    assert media.resolving == {}
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Checks of the lease handling in sharding.py on a temporary state directory.
+Run with python -m pytest test_sharding.py
+'''
+
+import os
+import threading
+import time
+
+import sharding
+
+KEY = "playlist/PL1"
+
+
+def makeStale(worker, key):
+    path = worker.path("leases", sharding._fileName(key))
+    old = time.time() - worker.ttl - 1
+    os.utime(path, (old, old))
+
+
+def test_live_lease_is_not_taken(tmp_path):
+    a = sharding.Worker(str(tmp_path), "a", ttl=60)
+    b = sharding.Worker(str(tmp_path), "b", ttl=60)
+    assert a.acquire(KEY)
+    assert not b.acquire(KEY)
+    assert a.holds(KEY)
+    assert not b.holds(KEY)
+
+
+def test_stale_lease_is_taken_over(tmp_path):
+    a = sharding.Worker(str(tmp_path), "a", ttl=60)
+    b = sharding.Worker(str(tmp_path), "b", ttl=60)
+    assert a.acquire(KEY)
+    token = a.held[KEY]
+    makeStale(a, KEY)
+
+    assert b.acquire(KEY)
+    assert b.holds(KEY)
+    # the old owner's token no longer matches
+    assert not a.holds(KEY)
+    assert not a.renew(KEY, token)
+
+    # releasing the lost lease must not remove the new owner's lease
+    a.release(KEY)
+    assert b.holds(KEY)
+    b.release(KEY)
+    assert b.readLease(KEY) == (None, None)
+
+
+def test_stale_lease_is_taken_over_once(tmp_path):
+    owner = sharding.Worker(str(tmp_path), "owner", ttl=60)
+    assert owner.acquire(KEY)
+    makeStale(owner, KEY)
+
+    workers = [sharding.Worker(str(tmp_path), "w{0}".format(i), ttl=60) for i in range(8)]
+    acquired = []
+    start = threading.Barrier(len(workers))
+
+    def take(worker):
+        start.wait()
+        if worker.acquire(KEY):
+            acquired.append(worker.worker_id)
+
+    threads = [threading.Thread(target=take, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(acquired) == 1
+    assert [w for w in workers if w.holds(KEY)][0].worker_id == acquired[0]
+    assert not os.path.exists(owner.path("leases", sharding._fileName(KEY)) + ".breaker")
+
+
+def test_claim_splits_feeds_and_skips_recently_done(tmp_path):
+    items = [{"channel": None, "playlist": "PL{0}".format(i), "filter": None} for i in range(50)]
+    a = sharding.Worker(str(tmp_path), "a", ttl=60, min_interval=600)
+    b = sharding.Worker(str(tmp_path), "b", ttl=60, min_interval=600)
+    a.heartbeat()
+    b.heartbeat()
+
+    claimed_a = [sharding.feedKey(item) for item in a.claim(items)]
+    claimed_b = [sharding.feedKey(item) for item in b.claim(items)]
+    assert len(claimed_a) > 0 and len(claimed_b) > 0
+    assert set(claimed_a).isdisjoint(claimed_b)
+    assert len(claimed_a) + len(claimed_b) == len(items)
+
+    for key in claimed_a:
+        a.release(key, done=True)
+    assert a.claim(items) == []
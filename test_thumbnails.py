@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Checks of thumbnails.py against the /vi/ endpoint of fakeyoutube.py.
+Run with python -m pytest test_thumbnails.py
+'''
+
+import os
+import threading
+import time
+
+import fakeyoutube
+import sharding
+import thumbnails
+
+BASE_URL = "https://example.com/generated/"
+
+
+def feeds(upstream, ids=("abc",)):
+    url = upstream.fake.base_url + "/vi/{0}/hqdefault.jpg"
+    return [({"imgurl": url.format("UC1")}, [{"image": url.format(i)} for i in ids])]
+
+
+def mirrorFeeds(outdir, upstream, ids=("abc",), sizes=(), **kwargs):
+    mirror = thumbnails.ThumbnailMirror(str(outdir), BASE_URL, sizes=sizes, **kwargs)
+    result = feeds(upstream, ids)
+    mirror.rewrite(result)
+    return mirror, result
+
+
+def test_thumbnails_are_revalidated_after_ttl(tmp_path):
+    upstream = fakeyoutube.start()
+    try:
+        mirror, result = mirrorFeeds(tmp_path, upstream)
+        assert mirror.downloaded == 2
+        local = result[0][1][0]["image"]
+        assert local.startswith(BASE_URL + "thumbs/")
+        requests_before = upstream.fake.getStats()["thumbnail_requests"]
+
+        # within the ttl nothing is requested
+        mirror, result = mirrorFeeds(tmp_path, upstream)
+        assert upstream.fake.getStats()["thumbnail_requests"] == requests_before
+        assert result[0][1][0]["image"] == local
+
+        # after the ttl an unchanged thumbnail is answered with 304
+        mirror, result = mirrorFeeds(tmp_path, upstream, ttl=0)
+        assert upstream.fake.getStats()["thumbnail_requests"] == requests_before + 2
+        assert mirror.downloaded == 0
+        assert result[0][1][0]["image"] == local
+
+        # a replaced thumbnail is downloaded again under the same URL
+        upstream.fake.config["thumbnail_version"] = 1
+        mirror, result = mirrorFeeds(tmp_path, upstream, ttl=0)
+        assert mirror.downloaded == 2
+        assert result[0][1][0]["image"] != local
+    finally:
+        upstream.shutdown()
+
+
+def test_feeds_point_at_resized_variants(tmp_path):
+    from PIL import Image
+
+    upstream = fakeyoutube.start()
+    try:
+        mirror, result = mirrorFeeds(tmp_path, upstream, ids=("def",), sizes=(160,))
+        thumbs = str(tmp_path / "thumbs")
+        entry = mirror.loadIndex()[feeds(upstream, ("def",))[0][1][0]["image"]]
+        variant = mirror.fileName(entry, 160)
+        assert variant.endswith("_160.jpg")
+        assert result[0][1][0]["image"] == BASE_URL + "thumbs/" + variant
+        with Image.open(os.path.join(thumbs, variant)) as image:
+            assert image.format == "JPEG"
+            assert max(image.size) <= 160
+
+        # pruning removes the variant together with the original
+        time.sleep(0.1)
+        mirror, result = mirrorFeeds(tmp_path, upstream, ids=(), sizes=(160,), prune_after=0.05, grace=0)
+        names = os.listdir(thumbs)
+        assert variant not in names and mirror.fileName(entry) not in names
+        assert result[0][0]["imgurl"].endswith("_160.jpg")
+    finally:
+        upstream.shutdown()
+
+
+def test_error_page_is_not_mirrored(tmp_path):
+    upstream = fakeyoutube.start(config={"thumbnail_error_page": True})
+    try:
+        original = feeds(upstream)
+        mirror, result = mirrorFeeds(tmp_path, upstream)
+        assert result == original
+        assert os.listdir(str(tmp_path / "thumbs")) == ["index.json"]
+
+        # a mirrored copy is kept when the thumbnail turns into an error page later
+        upstream.fake.config["thumbnail_error_page"] = False
+        mirror, result = mirrorFeeds(tmp_path, upstream)
+        local = result[0][1][0]["image"]
+        upstream.fake.config["thumbnail_error_page"] = True
+        mirror, result = mirrorFeeds(tmp_path, upstream, ttl=0)
+        assert result[0][1][0]["image"] == local
+    finally:
+        upstream.shutdown()
+
+
+def test_unused_thumbnails_are_pruned(tmp_path):
+    upstream = fakeyoutube.start()
+    try:
+        mirrorFeeds(tmp_path, upstream, ids=("abc", "def"))
+        thumbs = str(tmp_path / "thumbs")
+        assert len(os.listdir(thumbs)) > 1
+
+        # abc and def are no longer in any feed; the channel image still is
+        time.sleep(0.1)
+        mirror, result = mirrorFeeds(tmp_path, upstream, ids=(), prune_after=0.05, grace=0)
+        index = mirror.loadIndex()
+        assert list(index) == [feeds(upstream)[0][0]["imgurl"]]
+        entry = list(index.values())[0]
+        assert sorted(os.listdir(thumbs)) == sorted(["index.json", mirror.fileName(entry)])
+    finally:
+        upstream.shutdown()
+
+
+def test_concurrent_workers_keep_all_index_entries(tmp_path):
+    worker = sharding.Worker(str(tmp_path / "state"), "w", ttl=60)
+    mirrors = [thumbnails.ThumbnailMirror(str(tmp_path), BASE_URL, sizes=()) for i in range(2)]
+    now = time.time()
+    for i, mirror in enumerate(mirrors):
+        for j in range(1000):
+            mirror.added["http://example.com/{0}/{1}.jpg".format(i, j)] = \
+                {"sha256": "{0:064x}".format(i * 1000 + j), "ext": "jpg", "fetched": now, "used": now}
+
+    start = threading.Barrier(len(mirrors))
+
+    def save(mirror):
+        start.wait()
+        mirror.rewrite([], worker.exclusive("thumbs"))
+
+    threads = [threading.Thread(target=save, args=(mirror,)) for mirror in mirrors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(mirrors[0].loadIndex()) == 2000
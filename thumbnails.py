@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Optional thumbnail mirror: downloads the channel and item images of the fetched feeds once,
+stores them content-addressed under generated/thumbs/, creates small resized JPEG variants
+and rewrites the feed image URLs to point at them.
+
+generated/thumbs/index.json maps every source URL to the SHA-256 of its content, so
+identical images behind different URLs are stored once. A mirrored URL is revalidated with
+If-None-Match/If-Modified-Since once it is older than ttl seconds, because YouTube keeps the
+URL when a creator replaces a thumbnail. Entries no feed used for prune_after seconds are
+dropped, and their files once unused for grace seconds. Only image/* responses are mirrored.
+Resizing needs Pillow; without it the feeds point at the mirrored originals.
+'''
+
+import hashlib
+import io
+import json
+import contextlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import generator
+
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+
+
+class ThumbnailMirror(object):
+    '''
+    Mirror of the thumbnails in outdir + "thumbs/", served as base_url + "thumbs/".
+    The feeds use the variant of the first of sizes (longest side, in pixels).
+    '''
+
+    def __init__(self, outdir, base_url, sizes=(320,), workers=10, timeout=30, ttl=86400,
+                 prune_after=30 * 86400, grace=3600):
+        if outdir[-1] != os.sep:
+            outdir += os.sep
+        if base_url[-1] != "/":
+            base_url += "/"
+        self.dir = outdir + "thumbs" + os.sep
+        self.base_url = base_url + "thumbs/"
+        self.sizes = list(sizes)
+        self.workers = workers
+        self.timeout = timeout
+        self.ttl = ttl
+        self.prune_after = prune_after
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        os.makedirs(self.dir, exist_ok=True)
+        self.index = self.loadIndex()
+        self.added = {}
+        self.downloaded = 0
+
+    def loadIndex(self):
+        try:
+            with open(self.dir + "index.json", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def saveIndex(self):
+        # other workers may have mirrored thumbnails meanwhile, keep their entries; callers
+        # sharing the mirror hold a lock, or an entry saved in between is lost
+        index = self.loadIndex()
+        with self.lock:
+            index.update(self.added)
+
+        now = time.time()
+        pruned = [url for url, entry in index.items() if now - entry.get("used", 0) > self.prune_after]
+        for url in pruned:
+            del index[url]
+        generator.writeAtomic(self.dir + "index.json", json.dumps(index, indent=1).encode("utf-8"))
+
+        # remove originals and variants no entry refers to any more; files used recently may
+        # belong to another worker that has not saved its index yet
+        kept = set(entry["sha256"] for entry in index.values())
+        unused = {}  # sha256 -> (file names, last use of any of them)
+        for name in os.listdir(self.dir):
+            sha = name.split(".")[0].split("_")[0]
+            if name == "index.json" or sha in kept:
+                continue
+            try:
+                mtime = os.path.getmtime(self.dir + name)
+            except FileNotFoundError:
+                continue
+            names, used = unused.get(sha, ([], 0))
+            unused[sha] = (names + [name], max(used, mtime))
+        for names, used in unused.values():
+            if now - used > self.grace:
+                for name in names:
+                    try:
+                        os.remove(self.dir + name)
+                    except FileNotFoundError:
+                        pass
+        return len(pruned)
+
+    def fileName(self, entry, size=None):
+        if size is None:
+            return "{0}.{1}".format(entry["sha256"], entry["ext"])
+        return "{0}_{1}.jpg".format(entry["sha256"], size)
+
+    def localUrl(self, entry):
+        # the first variant if it exists, the original e.g. when Pillow is missing
+        if len(self.sizes) > 0 and os.path.exists(self.dir + self.fileName(entry, self.sizes[0])):
+            return self.base_url + self.fileName(entry, self.sizes[0])
+        return self.base_url + self.fileName(entry)
+
+    def mirror(self, url):
+        '''
+        Mirror one thumbnail and return its local URL, or url itself when it cannot be mirrored.
+        '''
+        with self.lock:
+            entry = self.index.get(url)
+        if entry is not None:
+            try:
+                # keeps the file out of another worker's pruning, see saveIndex
+                os.utime(self.dir + self.fileName(entry))
+            except FileNotFoundError:
+                entry = None
+        if entry is None or time.time() - entry.get("fetched", 0) > self.ttl:
+            entry = self.fetch(url, entry)
+            if entry is None:
+                return url
+
+        entry = dict(entry, used=time.time())
+        with self.lock:
+            self.index[url] = entry
+            self.added[url] = entry
+
+        self.resize(entry)
+        return self.localUrl(entry)
+
+    def fetch(self, url, entry):
+        '''
+        Download url, conditionally when entry is its mirrored copy, and return the entry to use:
+        the new one, entry itself when it is unchanged or url cannot be downloaded, or None.
+        '''
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("modified"):
+                headers["If-Modified-Since"] = entry["modified"]
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print("Cannot mirror thumbnail {0}: {1}".format(url, e))
+            return entry
+        if response.status_code == 304:
+            return dict(entry, fetched=time.time())
+
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if not content_type.startswith("image/"):
+            # e.g. an HTML error page, never serve it as a thumbnail
+            print("Cannot mirror thumbnail {0}: {1} is not an image".format(url, content_type or "no content type"))
+            return entry
+
+        new = {"sha256": hashlib.sha256(response.content).hexdigest(),
+               "ext": EXTENSIONS.get(content_type, content_type[len("image/"):].split("+")[0] or "img"),
+               "fetched": time.time(),
+               "etag": response.headers.get("ETag"),
+               "modified": response.headers.get("Last-Modified")}
+        path = self.dir + self.fileName(new)
+        if not os.path.exists(path):
+            generator.writeAtomic(path, response.content)
+        with self.lock:
+            self.downloaded += 1
+        return new
+
+    def resize(self, entry):
+        missing = [size for size in self.sizes if not os.path.exists(self.dir + self.fileName(entry, size))]
+        if len(missing) == 0:
+            return
+        try:
+            from PIL import Image
+        except ImportError:
+            return
+
+        try:
+            with Image.open(self.dir + self.fileName(entry)) as image:
+                image = image.convert("RGB")
+                for size in missing:
+                    variant = image.copy()
+                    variant.thumbnail((size, size))
+                    data = io.BytesIO()
+                    variant.save(data, "JPEG", quality=85, optimize=True)
+                    generator.writeAtomic(self.dir + self.fileName(entry, size), data.getvalue())
+        except (OSError, ValueError) as e:
+            print("Cannot resize thumbnail {0}: {1}".format(entry["sha256"], e))
+
+    def rewrite(self, feeds, index_lock=None):
+        '''
+        Mirror the channel and item images of feeds, a list of (channel_info, videos) tuples
+        as passed to generator.generateAll, and point them at the mirror. Workers sharing the
+        mirror pass index_lock, a context manager held while index.json is updated.
+        '''
+        urls = set()
+        for channel_info, videos in feeds:
+            urls.add(channel_info["imgurl"])
+            urls.update(video["image"] for video in videos)
+        urls.discard(None)
+        urls = sorted(urls)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            local = dict(zip(urls, pool.map(self.mirror, urls)))
+
+        for channel_info, videos in feeds:
+            channel_info["imgurl"] = local.get(channel_info["imgurl"], channel_info["imgurl"])
+            for video in videos:
+                video["image"] = local.get(video["image"], video["image"])
+
+        with index_lock or contextlib.nullcontext():
+            pruned = self.saveIndex()
+        print("Mirrored {0} thumbnails, {1} downloaded, {2} pruned".format(len(urls), self.downloaded, pruned))